@@ -4,6 +4,10 @@ from discord.ext import commands, tasks
 import json
 import os
 import multiprocessing
+import threading
+import traceback
+import hashlib
+import math
 import time
 from datetime import datetime
 import asyncio
@@ -17,6 +21,14 @@ BOT_TOKEN = os.environ.get("BOT_TOKEN")
 PROGRESS_CHANNEL_ID = int(os.environ.get("PROGRESS_CHANNEL_ID", 0))
 API_SECRET_KEY = os.environ.get("API_SECRET_KEY")
 
+# --- Konfigurasi Supervisor Bot ---
+HEARTBEAT_INTERVAL = 2.0 # Detik antar heartbeat dari proses bot ke supervisor
+STALL_TIMEOUT = 90.0 # Bot dianggap macet jika tidak ada heartbeat selama ini
+SHUTDOWN_TIMEOUT = 15.0 # Batas waktu bot.close() sebelum proses dipaksa berhenti
+RESTART_BACKOFF_BASE = 2.0 # Jeda restart pertama, berlipat dua setiap crash beruntun
+RESTART_BACKOFF_MAX = 300.0
+RESTART_BACKOFF_RESET = 120.0 # Bot yang sudah berjalan selama ini dianggap stabil, backoff direset
+
 # --- File Penyimpanan ---
 # Cek apakah kita berjalan di Railway, jika ya, gunakan volume
 if "RAILWAY_PROJECT_ID" in os.environ:
@@ -79,9 +91,11 @@ def seed_initial_data():
 # ==============================================================================
 # BAGIAN KODE BOT DISCORD
 # ==============================================================================
-def run_bot():
+def run_bot(heartbeat_conn=None, stop_event=None):
     intents = discord.Intents.default()
     bot = commands.Bot(command_prefix="!", intents=intents)
+    # Waktu publikasi terakhir dimuat dari cache agar tetap berlanjut setelah restart
+    publish_state = {"last_publish": load_data(PUBLIC_MESSAGE_ID_FILE).get("last_publish")}
 
     def calculate_percentage(subtasks):
         if not subtasks: return 0
@@ -105,7 +119,7 @@ def run_bot():
             green = 255
         return discord.Color.from_rgb(red, green, 0)
 
-    async def update_public_message(bot_instance):
+    async def update_public_message(bot_instance, resume=False):
         if not PROGRESS_CHANNEL_ID: return
         channel = bot_instance.get_channel(PROGRESS_CHANNEL_ID)
         if not channel: 
@@ -159,25 +173,40 @@ def run_bot():
 
         msg_data = load_data(PUBLIC_MESSAGE_ID_FILE)
         msg_id = msg_data.get("message_id")
-        message_to_edit = None
+        content_hash = hashlib.sha256(json.dumps(embed.to_dict(), sort_keys=True).encode('utf-8')).hexdigest()
 
-        if msg_id:
+        # Saat melanjutkan setelah restart, pesan yang isinya sama dengan cache tidak perlu diedit lagi,
+        # cukup dipastikan masih ada (bisa saja dihapus selama bot mati)
+        if resume and msg_id and msg_data.get("content_hash") == content_hash:
             try:
-                message_to_edit = await channel.fetch_message(msg_id)
-            except (discord.NotFound, discord.HTTPException):
+                await channel.fetch_message(msg_id)
+                print(f"Melanjutkan dari cache: pesan {msg_id} sudah terbaru.")
+                return
+            except discord.NotFound:
                 print(f"Pesan lama dengan ID {msg_id} tidak ditemukan. Akan membuat pesan baru.")
-                message_to_edit = None
-        
+                msg_id = None
+            except discord.HTTPException as e:
+                print(f"Tidak dapat memeriksa pesan {msg_id}, menganggapnya masih terbaru: {e}")
+                return
+
         try:
-            if message_to_edit:
-                await message_to_edit.edit(embed=embed)
-            else:
-                # Blok ini dijalankan jika msg_id tidak ada ATAU fetch_message gagal
+            if msg_id:
+                try:
+                    # Edit lewat partial message, tanpa fetch_message terlebih dahulu
+                    await channel.get_partial_message(msg_id).edit(embed=embed)
+                except discord.NotFound:
+                    print(f"Pesan lama dengan ID {msg_id} tidak ditemukan. Akan membuat pesan baru.")
+                    msg_id = None
+            if not msg_id:
                 new_msg = await channel.send(embed=embed)
-                save_data({"message_id": new_msg.id}, PUBLIC_MESSAGE_ID_FILE)
+                msg_id = new_msg.id
                 print(f"Membuat atau mengganti pesan progres. ID Baru: {new_msg.id}")
         except discord.Forbidden:
             print(f"Error: Bot tidak memiliki izin untuk mengirim/mengedit pesan di channel {PROGRESS_CHANNEL_ID}.")
+            return
+
+        publish_state["last_publish"] = time.time()
+        save_data({"message_id": msg_id, "content_hash": content_hash, "last_publish": publish_state["last_publish"]}, PUBLIC_MESSAGE_ID_FILE)
 
 
     @tasks.loop(seconds=5.0)
@@ -188,19 +217,55 @@ def run_bot():
         if update_queue.get("update_needed"):
             # Log Diagnostik Ditambahkan
             print(">>> PEMBARUAN DITEMUKAN! Memperbarui pesan Discord...")
-            await update_public_message(bot)
+            try:
+                await update_public_message(bot)
+            except discord.HTTPException as e:
+                # HTTPException tidak ditangani tasks.loop dan akan mematikan loop ini, jadi antrian dibiarkan untuk dicoba lagi
+                print(f">>> Gagal memperbarui pesan Discord, akan dicoba lagi: {e}")
+                return
             save_data({}, UPDATE_QUEUE_FILE)
             print(">>> ANTRIAN DIBERSIHKAN.")
 
+    @tasks.loop(seconds=HEARTBEAT_INTERVAL)
+    async def supervisor_link():
+        if stop_event is not None and stop_event.is_set():
+            print("Sinyal berhenti dari supervisor diterima, menutup bot dengan rapi...")
+            supervisor_link.stop()
+            await bot.close()
+            return
+        # Heartbeat hanya dikirim selama gateway sehat dan loop publikasi berjalan, sehingga keduanya terdeteksi macet oleh supervisor
+        if heartbeat_conn is None or not bot.is_ready() or not math.isfinite(bot.latency) or not check_for_updates.is_running():
+            return
+        try:
+            heartbeat_conn.send({"latency": bot.latency, "last_publish": publish_state["last_publish"]})
+        except (BrokenPipeError, OSError):
+            pass
+
     @bot.event
     async def on_ready():
         print(f'Bot Discord telah login sebagai {bot.user}')
         print('------')
-        await update_public_message(bot)
-        check_for_updates.start()
+        try:
+            await update_public_message(bot, resume=True)
+        except discord.HTTPException as e:
+            print(f"Gagal memperbarui pesan progres saat startup, akan dicoba lagi: {e}")
+            trigger_bot_update()
+        # on_ready bisa terpanggil lagi setelah koneksi ulang, jangan mulai loop dua kali
+        if not check_for_updates.is_running():
+            check_for_updates.start()
+
+    async def main():
+        async with bot:
+            supervisor_link.start()
+            await bot.start(BOT_TOKEN)
 
     if BOT_TOKEN:
-        bot.run(BOT_TOKEN)
+        # Sama seperti bot.run(), aktifkan logging bawaan discord.py
+        discord.utils.setup_logging()
+        try:
+            asyncio.run(main())
+        except discord.LoginFailure:
+            print("Error: BOT_TOKEN tidak valid. Periksa kembali token di environment variables.")
     else:
         print("Error: BOT_TOKEN tidak ditemukan. Pastikan sudah diatur di environment variables.")
 
@@ -210,6 +275,127 @@ def run_bot():
 app = Flask(__name__)
 bot_process = None
 
+# --- State Supervisor Bot ---
+supervisor_lock = threading.Lock()
+supervisor_thread = None
+bot_wanted = False # True selama pengguna menginginkan bot berjalan (antara /start dan /stop)
+bot_stop_event = None
+heartbeat_conn = None
+bot_health = {
+    "started_at": None, "last_heartbeat": None, "latency": None, "last_publish": None,
+    "restarts": 0, "restart_delay": RESTART_BACKOFF_BASE, "next_restart_at": None, "stop_requested_at": None,
+}
+
+def spawn_bot():
+    """Menjalankan proses bot baru beserta kanal heartbeat-nya. Dipanggil dengan supervisor_lock terkunci."""
+    global bot_process, bot_stop_event, heartbeat_conn
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    stop_event = multiprocessing.Event()
+    process = multiprocessing.Process(target=run_bot, args=(child_conn, stop_event))
+    try:
+        process.start()
+    except Exception:
+        parent_conn.close()
+        raise
+    finally:
+        child_conn.close()
+    if heartbeat_conn:
+        heartbeat_conn.close()
+    bot_process, bot_stop_event, heartbeat_conn = process, stop_event, parent_conn
+    bot_health.update({"started_at": time.time(), "last_heartbeat": None, "latency": None,
+                       "next_restart_at": None, "stop_requested_at": None})
+    print(f"SUPERVISOR @ {datetime.now()}: Proses bot dimulai (PID {bot_process.pid})")
+
+def request_bot_stop(now):
+    """Meminta bot menutup diri dengan rapi lewat bot.close(), tanpa menunggu prosesnya selesai."""
+    bot_stop_event.set()
+    bot_health["stop_requested_at"] = now
+
+def drain_heartbeats():
+    """Membaca semua heartbeat yang menunggu di kanal tanpa memblokir."""
+    try:
+        while heartbeat_conn and heartbeat_conn.poll():
+            beat = heartbeat_conn.recv()
+            bot_health.update({"last_heartbeat": time.time(), "latency": beat.get("latency")})
+            if beat.get("last_publish"):
+                bot_health["last_publish"] = beat["last_publish"]
+    except (EOFError, OSError):
+        pass
+
+def schedule_restart(now, reason):
+    delay = bot_health["restart_delay"]
+    bot_health["restart_delay"] = min(delay * 2, RESTART_BACKOFF_MAX)
+    bot_health["next_restart_at"] = now + delay
+    bot_health["restarts"] += 1
+    print(f"SUPERVISOR @ {datetime.now()}: Bot {reason}, restart dalam {delay:.0f} detik.")
+
+def supervise_tick():
+    """Satu langkah supervisor: baca heartbeat, deteksi crash/macet, dan jadwalkan restart dengan backoff."""
+    global bot_process, bot_wanted
+    now = time.time()
+    drain_heartbeats()
+
+    if bot_process is None:
+        if bot_wanted and bot_health["next_restart_at"] and now >= bot_health["next_restart_at"]:
+            try:
+                spawn_bot()
+            except Exception:
+                schedule_restart(now, "gagal dijalankan")
+                raise
+        return
+
+    if bot_process.is_alive():
+        if bot_health["stop_requested_at"]:
+            if now - bot_health["stop_requested_at"] > SHUTDOWN_TIMEOUT:
+                print(f"SUPERVISOR @ {datetime.now()}: Bot tidak berhenti dalam {SHUTDOWN_TIMEOUT} detik, memaksa berhenti.")
+                bot_process.terminate()
+        elif not bot_wanted:
+            request_bot_stop(now)
+        elif now - (bot_health["last_heartbeat"] or bot_health["started_at"]) > STALL_TIMEOUT:
+            print(f"SUPERVISOR @ {datetime.now()}: Tidak ada heartbeat selama {STALL_TIMEOUT} detik, bot dianggap macet.")
+            request_bot_stop(now)
+        return
+
+    bot_process.join()
+    exitcode = bot_process.exitcode
+    bot_process = None
+    if not bot_wanted:
+        print(f"SUPERVISOR @ {datetime.now()}: Bot telah berhenti (exit code {exitcode}).")
+        return
+    if bot_health["next_restart_at"]:
+        # /start dipanggil selagi proses lama masih berhenti, proses baru dijalankan pada langkah berikutnya
+        return
+    if exitcode == 0 and not bot_health["stop_requested_at"]:
+        # Keluar dengan bersih tanpa diminta berarti konfigurasi salah (mis. token tidak valid), restart tidak akan membantu
+        bot_wanted = False
+        print(f"SUPERVISOR @ {datetime.now()}: Bot keluar tanpa error, kemungkinan karena konfigurasi. Supervisi dihentikan.")
+        return
+
+    # Proses bot sudah berhenti padahal masih diinginkan berjalan: crash atau dihentikan karena macet
+    if now - bot_health["started_at"] >= RESTART_BACKOFF_RESET:
+        bot_health["restart_delay"] = RESTART_BACKOFF_BASE
+    schedule_restart(now, f"berhenti (exit code {exitcode})")
+
+def supervise_bot():
+    while True:
+        with supervisor_lock:
+            try:
+                supervise_tick()
+            except Exception:
+                # Thread supervisor tidak boleh mati, jika tidak pipa heartbeat berhenti dibaca dan bot ikut macet
+                print(f"SUPERVISOR @ {datetime.now()}: Error saat mengawasi bot:")
+                traceback.print_exc()
+        time.sleep(1)
+
+def ensure_supervisor():
+    global supervisor_thread
+    if supervisor_thread is None or not supervisor_thread.is_alive():
+        supervisor_thread = threading.Thread(target=supervise_bot, daemon=True)
+        supervisor_thread.start()
+
+def format_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat(timespec='seconds') if timestamp else None
+
 # Template HTML tidak berubah
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -238,7 +424,7 @@ HTML_TEMPLATE = """
 <body class="bg-gray-900 text-white p-4 h-screen flex flex-col">
     <!-- PANEL KONTROL BOT -->
     <div class="bg-gray-800 rounded-lg p-4 mb-6 flex-shrink-0 flex justify-between items-center">
-        <div class="flex items-center space-x-3"><h2 class="text-xl font-bold">Panel Kontrol Bot</h2><div id="status-dot" class="status-dot status-inactive"></div><span id="status-text">Tidak Aktif</span></div>
+        <div class="flex items-center space-x-3"><h2 class="text-xl font-bold">Panel Kontrol Bot</h2><div id="status-dot" class="status-dot status-inactive"></div><span id="status-text">Tidak Aktif</span><span id="status-detail" class="text-sm text-gray-400"></span></div>
         <div class="flex items-center space-x-2">
             <button onclick="loadTasks()" class="bg-gray-600 hover:bg-gray-700 text-white font-bold py-2 px-4 rounded-md text-sm">Refresh Data</button>
             <button id="start-btn" class="bg-blue-600 hover:bg-blue-700 text-white font-bold py-2 px-4 rounded-md text-sm">Start</button>
@@ -258,18 +444,32 @@ HTML_TEMPLATE = """
         let currentTask = null;
         // --- Fungsi Kontrol Bot ---
         const startBtn = document.getElementById('start-btn'), stopBtn = document.getElementById('stop-btn'), restartBtn = document.getElementById('restart-btn');
-        const statusDot = document.getElementById('status-dot'), statusText = document.getElementById('status-text');
-        function updateBotUI(status) {
+        const statusDot = document.getElementById('status-dot'), statusText = document.getElementById('status-text'), statusDetail = document.getElementById('status-detail');
+        function updateBotUI(status, latencyMs) {
             if (status === 'running') {
-                statusDot.className = 'status-dot status-active'; statusText.textContent = 'Aktif';
+                statusDot.className = 'status-dot status-active'; statusText.textContent = latencyMs != null ? `Aktif (${latencyMs} ms)` : 'Aktif';
+                startBtn.disabled = true; stopBtn.disabled = false; restartBtn.disabled = false;
+            } else if (status === 'restarting') {
+                statusDot.className = 'status-dot status-inactive'; statusText.textContent = 'Memulai Ulang...';
                 startBtn.disabled = true; stopBtn.disabled = false; restartBtn.disabled = false;
+            } else if (status === 'stopping') {
+                statusDot.className = 'status-dot status-inactive'; statusText.textContent = 'Menghentikan...';
+                startBtn.disabled = false; stopBtn.disabled = true; restartBtn.disabled = true;
             } else {
                 statusDot.className = 'status-dot status-inactive'; statusText.textContent = 'Tidak Aktif';
                 startBtn.disabled = false; stopBtn.disabled = true; restartBtn.disabled = true;
             }
         }
+        function updateBotDetail(data) {
+            const parts = [];
+            if (data.last_publish) parts.push(`Publikasi terakhir: ${data.last_publish.replace('T', ' ')}`);
+            if (data.last_heartbeat) parts.push(`Heartbeat: ${data.last_heartbeat.replace('T', ' ')}`);
+            if (data.restarts) parts.push(`Restart: ${data.restarts}x`);
+            if (data.next_restart_in != null) parts.push(`Restart berikutnya dalam ${data.next_restart_in} detik`);
+            statusDetail.textContent = parts.join(' · ');
+        }
         async function checkBotStatus() {
-            try { const response = await fetch('/status'); updateBotUI((await response.json()).status); } catch (error) { console.error('Gagal memeriksa status bot:', error); updateBotUI('stopped'); }
+            try { const response = await fetch('/status'); const data = await response.json(); updateBotUI(data.status, data.latency_ms); updateBotDetail(data); } catch (error) { console.error('Gagal memeriksa status bot:', error); updateBotUI('stopped'); updateBotDetail({}); }
         }
         startBtn.addEventListener('click', async () => { await fetch('/start', { method: 'POST' }); setTimeout(checkBotStatus, 1000); });
         stopBtn.addEventListener('click', async () => { await fetch('/stop', { method: 'POST' }); setTimeout(checkBotStatus, 1000); });
@@ -632,25 +832,56 @@ def delete_subtask(task_name, category_name, subtask_name):
 # --- Kontrol Proses Bot ---
 @app.route('/start', methods=['POST'])
 def start_bot():
-    global bot_process
-    if bot_process and bot_process.is_alive(): return jsonify({"status": "already running"}), 400
-    bot_process = multiprocessing.Process(target=run_bot)
-    bot_process.start()
+    global bot_wanted
+    if not BOT_TOKEN:
+        return jsonify({"status": "error", "message": "BOT_TOKEN tidak ditemukan. Pastikan sudah diatur di environment variables."}), 400
+    with supervisor_lock:
+        if bot_wanted: return jsonify({"status": "already running"}), 400
+        bot_wanted = True
+        bot_health.update({"restarts": 0, "restart_delay": RESTART_BACKOFF_BASE})
+        if bot_process:
+            # Proses lama masih menutup diri, supervisor akan menjalankan yang baru setelah proses itu selesai
+            bot_health["next_restart_at"] = time.time()
+        else:
+            try:
+                spawn_bot()
+            except Exception as e:
+                bot_wanted = False
+                print(f"Gagal menjalankan proses bot: {e}")
+                return jsonify({"status": "error", "message": f"Gagal menjalankan bot: {e}"}), 500
+    ensure_supervisor()
     return jsonify({"status": "started"})
 
 @app.route('/stop', methods=['POST'])
 def stop_bot():
-    global bot_process
-    if not bot_process or not bot_process.is_alive(): return jsonify({"status": "already stopped"}), 400
-    bot_process.terminate()
-    bot_process.join()
-    bot_process = None
-    return jsonify({"status": "stopped"})
+    global bot_wanted
+    with supervisor_lock:
+        if not bot_wanted: return jsonify({"status": "already stopped"}), 400
+        bot_wanted = False
+        bot_health["next_restart_at"] = None
+        if bot_process and bot_process.is_alive() and not bot_health["stop_requested_at"]:
+            request_bot_stop(time.time())
+    ensure_supervisor()
+    return jsonify({"status": "stopping" if bot_process else "stopped"})
 
 @app.route('/status')
 def status():
-    global bot_process
-    return jsonify({"status": "running" if bot_process and bot_process.is_alive() else "stopped"})
+    with supervisor_lock:
+        drain_heartbeats()
+        if not bot_wanted: state = "stopping" if bot_process else "stopped"
+        elif bot_process and bot_process.is_alive() and not bot_health["stop_requested_at"]: state = "running"
+        else: state = "restarting"
+        latency = bot_health["latency"]
+        last_publish = bot_health["last_publish"] or load_data(PUBLIC_MESSAGE_ID_FILE).get("last_publish")
+        return jsonify({
+            "status": state,
+            "pid": bot_process.pid if bot_process else None,
+            "latency_ms": round(latency * 1000) if state == "running" and latency is not None else None,
+            "last_heartbeat": format_timestamp(bot_health["last_heartbeat"]),
+            "last_publish": format_timestamp(last_publish),
+            "restarts": bot_health["restarts"],
+            "next_restart_in": max(0, round(bot_health["next_restart_at"] - time.time())) if bot_health["next_restart_at"] else None,
+        })
 
 if __name__ == '__main__':
     seed_initial_data()